@@ -3,7 +3,8 @@ import sys
 from dotenv import load_dotenv
 
 # ✅ Determine base path whether running as EXE or .py
-base_path = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__)
+_IS_FROZEN = getattr(sys, 'frozen', False)
+base_path = os.path.dirname(sys.executable if _IS_FROZEN else __file__)
 
 # ✅ Load .env next to EXE or script
 dotenv_path = os.path.join(base_path, ".env")
@@ -25,9 +26,6 @@ from mediaflow_proxy.main import app
 def run():
     import uvicorn
 
-    # Check if running as frozen EXE
-    is_frozen = getattr(sys, 'frozen', False)
-
     # Try to load HTTPS certs from the same folder
     cert_file = os.path.join(base_path, "cert.pem")
     key_file = os.path.join(base_path, "key.pem")
@@ -44,7 +42,7 @@ def run():
         app,
         host="0.0.0.0",
         port=8888,
-        reload=not is_frozen,
+        reload=not _IS_FROZEN,
         workers=1,
         log_level="info",
         **ssl_args
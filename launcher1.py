@@ -1,27 +1,81 @@
 #!/usr/bin/env python3
 import os
 import sys
+import hashlib
 import ipaddress
 import logging
 import signal
 import socket
+from functools import lru_cache
 from pathlib import Path
-from typing import Tuple, Dict, Any, Optional
+from typing import Tuple, Dict, Any, List, NamedTuple, Optional, Union
 
-import uvicorn
 from dotenv import load_dotenv
 
+_IS_FROZEN = getattr(sys, "frozen", False)
+_BASE_PATH = Path(sys.executable).resolve().parent if _IS_FROZEN else Path(__file__).resolve().parent
+
+
+_TRUE_VALUES = frozenset({"1", "true", "yes", "on"})
+
 
 def parse_bool(value: Optional[str], default: bool = False) -> bool:
     if value is None:
         return default
-    return value.strip().lower() in ("1", "true", "yes", "on")
+    return value.strip().lower() in _TRUE_VALUES
+
+
+def parse_forwarded_allow_ips(value: Optional[str]) -> Union[str, List[str]]:
+    """Return "*" to trust every proxy, otherwise the list of trusted addresses."""
+    if value is None or value.strip() in ("", "*"):
+        return "*"
+    return [ip.strip() for ip in value.split(",") if ip.strip()]
+
+
+class LauncherEnv(NamedTuple):
+    """Launcher settings read once from the environment."""
+
+    port: str
+    api_password: Optional[str]
+    debug: bool
+    host: str
+    http2: bool
+    disable_https: bool
+    cert_additional_ips: str
+    forwarded_allow_ips: Union[str, List[str]]
+
+
+_ENV: Optional[LauncherEnv] = None
+_DOTENV_LOADED = False
+
+
+def _load_dotenv_once(dotenv_path: Path) -> None:
+    """Parse the .env file only on the first call in this process."""
+    global _DOTENV_LOADED
+    if _DOTENV_LOADED:
+        return
+    load_dotenv(dotenv_path=dotenv_path)
+    _DOTENV_LOADED = True
+
+
+def snapshot_env() -> LauncherEnv:
+    """Read launcher settings from os.environ and cache them for later lookups."""
+    global _ENV
+    _ENV = LauncherEnv(
+        port=os.getenv("PORT", "8888"),
+        api_password=os.getenv("API_PASSWORD"),
+        debug=parse_bool(os.getenv("DEBUG"), default=False),
+        host=os.getenv("HOST", "0.0.0.0"),
+        http2=parse_bool(os.getenv("UVICORN_HTTP2"), default=True),
+        disable_https=parse_bool(os.getenv("DISABLE_HTTPS"), default=False),
+        cert_additional_ips=os.getenv("CERT_ADDITIONAL_IPS", "").strip(),
+        forwarded_allow_ips=parse_forwarded_allow_ips(os.getenv("FORWARDED_ALLOW_IPS")),
+    )
+    return _ENV
 
 
-def get_runtime_base() -> Path:
-    if getattr(sys, "frozen", False):
-        return Path(sys.executable).resolve().parent
-    return Path(__file__).resolve().parent
+def get_env() -> LauncherEnv:
+    return _ENV if _ENV is not None else snapshot_env()
 
 
 def prepare_env_paths(base_path: Path) -> None:
@@ -30,10 +84,39 @@ def prepare_env_paths(base_path: Path) -> None:
         os.environ["PATH"] = f"{str(bin_path)}{os.pathsep}{os.environ.get('PATH','')}"
 
 
+def _hostname_ip() -> Optional[str]:
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except (OSError, UnicodeError):
+        return None
+
+
+def _primary_ip() -> Optional[str]:
+    # Connect to a remote address to determine the best local IP
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except (OSError, UnicodeError):
+        return None
+
+
+@lru_cache(maxsize=1)
+def _local_ips() -> Tuple[str, ...]:
+    """Detect the non-loopback local IPv4 address once per process.
+
+    The UDP-connect probe sends no packets and avoids resolver lookups, so the
+    hostname resolution (which can block on NSS/DNS) only runs as a fallback.
+    """
+    ip = _primary_ip() or _hostname_ip()
+    return (ip,) if ip and ip != "127.0.0.1" else ()
+
+
 def validate_config() -> Tuple[int, bool]:
     """Validate PORT and API_PASSWORD, show warnings, return (port, debug)."""
+    env = get_env()
     try:
-        port = int(os.getenv("PORT", "8888"))
+        port = int(env.port)
         if not (1 <= port <= 65535):
             raise ValueError(f"{port} out of valid range (1–65535)")
     except ValueError as e:
@@ -41,13 +124,13 @@ def validate_config() -> Tuple[int, bool]:
         port = 8888
         print(f"🔄 Using default PORT: {port}")
 
-    api_pw = os.getenv("API_PASSWORD")
+    api_pw = env.api_password
     if not api_pw:
         print("⚠️ WARNING: API_PASSWORD is not set!")
     elif api_pw == "changeme":
         print("⚠️ WARNING: You are using the default API password 'changeme'!")
 
-    debug = parse_bool(os.getenv("DEBUG"), default=False)
+    debug = env.debug
     if debug:
         print("🐛 Debug mode enabled")
         print(f"🔐 API_PASSWORD: {api_pw or '<not set>'}")
@@ -58,26 +141,33 @@ def validate_config() -> Tuple[int, bool]:
 
 def show_startup_info(base_path: Path, protocol: str, host: str, port: int) -> None:
     """Print startup banner with working directory and listen URLs."""
-    print("=" * 50)
-    print("🎬 MediaFlow Proxy Server")
-    print("=" * 50)
-    print(f"📁 Working directory: {base_path}")
-    print(f"🌐 Serving on: {protocol}://{host}:{port}")
+    lines = [
+        "=" * 50,
+        "🎬 MediaFlow Proxy Server",
+        "=" * 50,
+        f"📁 Working directory: {base_path}",
+        f"🌐 Serving on: {protocol}://{host}:{port}",
+    ]
     if host in ("0.0.0.0", "::"):
-        print(f"   • Local:   {protocol}://127.0.0.1:{port}")
-        try:
-            hostname = socket.gethostname()
-            local_ip = socket.gethostbyname(hostname)
-            print(f"   • Network: {protocol}://{local_ip}:{port}")
-        except Exception:
-            pass
-    print("=" * 50)
+        lines.append(f"   • Local:   {protocol}://127.0.0.1:{port}")
+        for local_ip in _local_ips():
+            lines.append(f"   • Network: {protocol}://{local_ip}:{port}")
+    lines.append("=" * 50)
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+
+def _write_ipset(ipset_file: Path, digest: str) -> None:
+    try:
+        ipset_file.write_text(digest)
+    except OSError as e:
+        print(f"⚠️ Could not write {ipset_file}: {e}")
 
 
 def ensure_cert(cert_base: Path) -> Tuple[Dict[str, Any], str]:
     """Dynamically generate SSL certificates with auto-detected IPs."""
-    disable_https = parse_bool(os.getenv("DISABLE_HTTPS"), default=False)
-    if disable_https:
+    env = get_env()
+    if env.disable_https:
         print("🔓 HTTPS disabled via DISABLE_HTTPS environment variable")
         print("🌐 Starting in HTTP mode")
         return {}, "HTTP"
@@ -86,12 +176,51 @@ def ensure_cert(cert_base: Path) -> Tuple[Dict[str, Any], str]:
     dist_bin.mkdir(parents=True, exist_ok=True)
     cert_file = dist_bin / "server.pem"
     key_file = dist_bin / "server.key"
+    ipset_file = dist_bin / "server.pem.ipset"
+    cert_tmp = dist_bin / "server.pem.tmp"
+    key_tmp = dist_bin / "server.key.tmp"
+
+    # Dynamically detect local network IPs
+    local_ips = _local_ips()
+    detected_ips = list(local_ips)
+    seen = {"127.0.0.1", *detected_ips}
+
+    # Optional: Add custom IPs from environment variable
+    for ip in env.cert_additional_ips.split(","):
+        ip = ip.strip()
+        if not ip or ip in seen:
+            continue
+        try:
+            ipaddress.IPv4Address(ip)
+        except ValueError:
+            print(f"⚠️ Invalid IP in CERT_ADDITIONAL_IPS: {ip}")
+            continue
+        seen.add(ip)
+        detected_ips.append(ip)
+
+    # Reuse existing certs unless this launcher generated them for a different IP set
+    ipset_digest = hashlib.sha256(",".join(sorted(detected_ips)).encode()).hexdigest()
+
+    ssl_config = {"ssl_certfile": str(cert_file), "ssl_keyfile": str(key_file)}
+    # Set when our own pair exists but its IP set is stale; kept if regeneration fails
+    stale_pair = False
+    # Set once the existing pair starts being replaced; it can no longer be kept after that
+    replacing = False
 
     if cert_file.exists() and key_file.exists():
         try:
             if cert_file.stat().st_size and key_file.stat().st_size:
-                print(f"🔐 Using existing certificates at {cert_file} + {key_file}")
-                return ({"ssl_certfile": str(cert_file), "ssl_keyfile": str(key_file)}, "HTTPS")
+                # Without a sidecar the pair is from an older version or supplied by the
+                # user: reuse it as-is and never overwrite it
+                if not ipset_file.exists() or ipset_file.read_text().strip() == ipset_digest:
+                    print(f"🔐 Using existing certificates at {cert_file} + {key_file}")
+                    return ssl_config, "HTTPS"
+                if not local_ips:
+                    # Offline start: the probe result is not a real IP change
+                    print("⚠️ No network IP detected; keeping existing certificates")
+                    return ssl_config, "HTTPS"
+                stale_pair = True
+                print("🔄 Certificate IPs (detected or CERT_ADDITIONAL_IPS) changed; regenerating...")
         except Exception as e:
             print(f"⚠️ Error reading certs: {e}; regenerating...")
 
@@ -100,10 +229,10 @@ def ensure_cert(cert_base: Path) -> Tuple[Dict[str, Any], str]:
         from cryptography.x509.oid import NameOID
         from cryptography.hazmat.primitives import hashes, serialization
         from cryptography.hazmat.backends import default_backend
-        from cryptography.hazmat.primitives.asymmetric import rsa
-        import datetime
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from datetime import datetime, timedelta, timezone
 
-        key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        key = ec.generate_private_key(ec.SECP256R1(), backend=default_backend())
         subject = issuer = x509.Name([
             x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
             x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "CA"),
@@ -119,74 +248,59 @@ def ensure_cert(cert_base: Path) -> Tuple[Dict[str, Any], str]:
             x509.IPAddress(ipaddress.IPv6Address("::1")),
         ]
         
-        # Dynamically detect local network IP
-        detected_ips = []
-        try:
-            hostname = socket.gethostname()
-            local_ip = socket.gethostbyname(hostname)
-            if local_ip != "127.0.0.1":
-                san_list.append(x509.IPAddress(ipaddress.IPv4Address(local_ip)))
-                detected_ips.append(local_ip)
-        except Exception:
-            pass
-            
-        # Try to get primary network interface IP
-        try:
-            # Connect to a remote address to determine the best local IP
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                s.connect(("8.8.8.8", 80))
-                primary_ip = s.getsockname()[0]
-                if primary_ip not in ["127.0.0.1"] + detected_ips:
-                    san_list.append(x509.IPAddress(ipaddress.IPv4Address(primary_ip)))
-                    detected_ips.append(primary_ip)
-        except Exception:
-            pass
-
-        # Optional: Add custom IPs from environment variable
-        custom_ips = os.getenv("CERT_ADDITIONAL_IPS", "").strip()
-        if custom_ips:
-            for ip in custom_ips.split(","):
-                ip = ip.strip()
-                if ip:
-                    try:
-                        san_list.append(x509.IPAddress(ipaddress.IPv4Address(ip)))
-                        detected_ips.append(ip)
-                    except Exception as e:
-                        print(f"⚠️ Invalid IP in CERT_ADDITIONAL_IPS: {ip}")
+        for ip in detected_ips:
+            san_list.append(x509.IPAddress(ipaddress.IPv4Address(ip)))
 
         san = x509.SubjectAlternativeName(san_list)
 
-        now = datetime.datetime.utcnow()
+        now = datetime.now(timezone.utc)
         cert = (
             x509.CertificateBuilder()
             .subject_name(subject)
             .issuer_name(issuer)
             .public_key(key.public_key())
             .serial_number(x509.random_serial_number())
-            .not_valid_before(now - datetime.timedelta(minutes=1))
-            .not_valid_after(now + datetime.timedelta(days=365))
+            .not_valid_before(now - timedelta(minutes=1))
+            .not_valid_after(now + timedelta(days=365))
             .add_extension(san, critical=False)
             .sign(key, hashes.SHA256(), default_backend())
         )
         
-        with open(cert_file, "wb") as f:
-            f.write(cert.public_bytes(serialization.Encoding.PEM))
-        with open(key_file, "wb") as f:
-            f.write(key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption(),
-            ))
+        cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+        key_pem = key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+        cert_tmp.write_bytes(cert_pem)
+        key_tmp.write_bytes(key_pem)
+        replacing = True
+        os.replace(key_tmp, key_file)
+        os.replace(cert_tmp, cert_file)
+        _write_ipset(ipset_file, ipset_digest)
         
         print(f"🔐 Generated self-signed cert at {cert_file} + {key_file}")
         if detected_ips:
             print(f"   Certificate includes detected IPs: {', '.join(detected_ips)}")
-        return ({"ssl_certfile": str(cert_file), "ssl_keyfile": str(key_file)}, "HTTPS")
+        if stale_pair:
+            print("⚠️ The certificate changed; clients that trusted the previous one must trust it again")
+        return ssl_config, "HTTPS"
         
     except ImportError:
+        if stale_pair:
+            print("⚠️ cryptography not available; keeping existing certificates with outdated IPs")
+            return ssl_config, "HTTPS"
         print("⚠️ cryptography not available; falling back to HTTP")
         return {}, "HTTP"
     except Exception as e:
+        for tmp in (cert_tmp, key_tmp):
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+        if stale_pair and not replacing:
+            print(f"⚠️ Error generating certs: {e}; keeping existing certificates with outdated IPs")
+            return ssl_config, "HTTPS"
         print(f"⚠️ Error generating certs: {e}; falling back to HTTP")
         return {}, "HTTP"
 
@@ -209,36 +323,45 @@ def build_uvicorn_config(
     ssl_config: Dict[str, Any],
     enable_http2: bool,
     debug: bool,
+    forwarded_allow_ips: Union[str, List[str]] = "*",
+    app: Any = "mediaflow_proxy.main:app",
 ) -> Dict[str, Any]:
-    config: Dict[str, Any] = {
-        "app": "mediaflow_proxy.main:app",
+    return {
+        "app": app,
         "host": host,
         "port": port,
         "log_level": "debug" if debug else "info",
         "proxy_headers": True,
-        "forwarded_allow_ips": "*",
+        "forwarded_allow_ips": forwarded_allow_ips,
         "http": "h11" if (ssl_config and enable_http2) else "auto",
+        **ssl_config,
     }
-    config.update(ssl_config)
-    return config
 
 
 def main() -> None:
-    runtime_base = get_runtime_base()
+    runtime_base = _BASE_PATH
     prepare_env_paths(runtime_base)
-    sys.path.insert(0, str(runtime_base))
-    load_dotenv(dotenv_path=runtime_base / ".env")
+    runtime_base_str = str(runtime_base)
+    if runtime_base_str not in sys.path:
+        sys.path.insert(0, runtime_base_str)
+    _load_dotenv_once(runtime_base / ".env")
+    env = snapshot_env()
 
     port, debug = validate_config()
-    host = os.getenv("HOST", "0.0.0.0")
-    enable_http2 = parse_bool(os.getenv("UVICORN_HTTP2"), default=True)
+    host = env.host
+    enable_http2 = env.http2
 
     configure_logging(debug)
 
     ssl_config, protocol = ensure_cert(runtime_base)
     show_startup_info(runtime_base, protocol, host, port)
 
-    uvicorn_cfg = build_uvicorn_config(port, host, ssl_config, enable_http2, debug)
+    # Import the app once here, after .env is loaded, instead of by import string in uvicorn
+    from mediaflow_proxy.main import app
+
+    uvicorn_cfg = build_uvicorn_config(
+        port, host, ssl_config, enable_http2, debug, env.forwarded_allow_ips, app=app
+    )
 
     def handle_signal(signum, frame):
         logging.info(f"Received signal {signum}. Shutting down...")
@@ -249,6 +372,8 @@ def main() -> None:
         except Exception:
             pass
 
+    import uvicorn
+
     uvicorn.run(**uvicorn_cfg)
 
 